@@ -1,4 +1,5 @@
 """Repo-wide pytest configuration and test fixtures."""
+import importlib
 import sys
 
 import pathlib
@@ -60,9 +61,76 @@ PLATFORM_NAMES = set("darwin linux win32".split())
 HOST_NAMES = set("diana florence".split())
 
 
+def _SerializeSetFlags(flag_values) -> typing.List[str]:
+  """Serialize the flags which have been set, on the command line or otherwise.
+
+  Args:
+    flag_values: The flags to serialize.
+
+  Returns:
+    A list of command line arguments, one per flag value.
+  """
+  # A flag may be registered under more than one name, e.g. a short name, so
+  # flags are de-duplicated by their full name.
+  flags = {flag_values[name].name: flag_values[name] for name in flag_values}
+  args = []
+  for name in sorted(flags):
+    flag = flags[name]
+    if not flag.using_default_value:
+      # A multi-valued flag serializes to one argument per value, separated by
+      # newlines. A flag with no value serializes to an empty string.
+      args += [arg for arg in flag.serialize().split('\n') if arg]
+  return args
+
+
+def _ParseKnownFlags(flag_values, args: typing.List[str]) -> typing.List[str]:
+  """Parse the command line arguments of the flags which are defined.
+
+  Args:
+    flag_values: The flags to parse the arguments into.
+    args: A list of command line arguments, as returned by
+      _SerializeSetFlags().
+
+  Returns:
+    The arguments of the flags which are not defined.
+  """
+  return flag_values(['argv[0]'] + args, known_only=True)[1:]
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+  """A pytest-xdist hook to configure a worker before it is started.
+
+  Workers do not run labm8.test.Main(), so the flags of the main process are
+  passed to them. Every flag which has been set, on the command line or
+  otherwise, is forwarded, not just those defined in //labm8:test.
+  """
+  node.workerinput['labm8_test_flags'] = _SerializeSetFlags(FLAGS)
+
+
+def pytest_configure(config):
+  """A pytest hook to perform initial configuration."""
+  # In a pytest-xdist worker, parse the flags passed from the main process by
+  # pytest_configure_node(). Importing //labm8:test defines its flags, but the
+  # flags of the modules under test are not defined until the test files are
+  # collected. The flags which are not yet defined are parsed later, by
+  # pytest_collection_modifyitems().
+  workerinput = getattr(config, 'workerinput', {})
+  if 'labm8_test_flags' in workerinput:
+    # Imported for the side effect of defining the flags of //labm8:test.
+    importlib.import_module('labm8.test')
+    config.labm8_test_unparsed_flags = _ParseKnownFlags(
+        FLAGS, workerinput['labm8_test_flags'])
+
+
 def pytest_collection_modifyitems(config, items):
   """A pytest hook to modify the configuration and items to run."""
-  del config
+  # In a pytest-xdist worker, parse the flags passed from the main process
+  # which were defined during collection. Any flags which remain undefined
+  # are not used by this worker, and are ignored.
+  unparsed_flags = getattr(config, 'labm8_test_unparsed_flags', [])
+  if unparsed_flags:
+    _ParseKnownFlags(FLAGS, unparsed_flags)
 
   # Fail early and verbosely if the flags cannot be accessed. This is a sign
   # that this file is being used incorrectly. To use this file, you must
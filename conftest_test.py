@@ -0,0 +1,113 @@
+"""Unit tests for //:conftest."""
+import pytest
+from absl import flags as absl_flags
+
+import conftest
+from labm8 import test
+
+FLAGS = test.FLAGS
+
+
+@pytest.fixture(scope='function')
+def flag_values() -> absl_flags.FlagValues:
+  """A test fixture which returns an empty set of flags."""
+  return absl_flags.FlagValues()
+
+
+# _SerializeSetFlags() tests.
+
+
+def test_SerializeSetFlags_unset_flags(flag_values: absl_flags.FlagValues):
+  """Test that flags which have their default values are not serialized."""
+  absl_flags.DEFINE_string('foo', 'a', 'Foo.', flag_values=flag_values)
+  absl_flags.DEFINE_string('bar', None, 'Bar.', flag_values=flag_values)
+  flag_values(['argv[0]'])
+  assert conftest._SerializeSetFlags(flag_values) == []
+
+
+def test_SerializeSetFlags_string_flag(flag_values: absl_flags.FlagValues):
+  """Test that a string flag is serialized."""
+  absl_flags.DEFINE_string('foo', 'a', 'Foo.', flag_values=flag_values)
+  flag_values(['argv[0]', '--foo=b'])
+  assert conftest._SerializeSetFlags(flag_values) == ['--foo=b']
+
+
+def test_SerializeSetFlags_boolean_flags(flag_values: absl_flags.FlagValues):
+  """Test that boolean flags are serialized in both their forms."""
+  absl_flags.DEFINE_boolean('foo', False, 'Foo.', flag_values=flag_values)
+  absl_flags.DEFINE_boolean('bar', True, 'Bar.', flag_values=flag_values)
+  flag_values(['argv[0]', '--foo', '--nobar'])
+  assert conftest._SerializeSetFlags(flag_values) == ['--nobar', '--foo']
+
+
+def test_SerializeSetFlags_multi_flag(flag_values: absl_flags.FlagValues):
+  """Test that a multi-valued flag is serialized to one argument per value."""
+  absl_flags.DEFINE_multi_string('foo', [], 'Foo.', flag_values=flag_values)
+  flag_values(['argv[0]', '--foo=a', '--foo=b'])
+  assert conftest._SerializeSetFlags(flag_values) == ['--foo=a', '--foo=b']
+
+
+def test_SerializeSetFlags_set_to_no_value(flag_values: absl_flags.FlagValues):
+  """Test that a flag which is set to no value is not serialized."""
+  absl_flags.DEFINE_string('foo', 'a', 'Foo.', flag_values=flag_values)
+  flag_values(['argv[0]'])
+  flag_values.foo = None
+  assert conftest._SerializeSetFlags(flag_values) == []
+
+
+def test_SerializeSetFlags_short_name(flag_values: absl_flags.FlagValues):
+  """Test that a flag with a short name is serialized once, by full name."""
+  absl_flags.DEFINE_string('foo',
+                           'a',
+                           'Foo.',
+                           short_name='f',
+                           flag_values=flag_values)
+  flag_values(['argv[0]', '-f=b'])
+  assert conftest._SerializeSetFlags(flag_values) == ['--foo=b']
+
+
+# _ParseKnownFlags() tests.
+
+
+def test_ParseKnownFlags_round_trip(flag_values: absl_flags.FlagValues):
+  """Test that serialized flags are parsed into another set of flags."""
+  worker_flag_values = absl_flags.FlagValues()
+  for fv in [flag_values, worker_flag_values]:
+    absl_flags.DEFINE_boolean('foo', True, 'Foo.', flag_values=fv)
+    absl_flags.DEFINE_multi_string('bar', [], 'Bar.', flag_values=fv)
+  flag_values(['argv[0]', '--nofoo', '--bar=a', '--bar=b'])
+
+  assert conftest._ParseKnownFlags(
+      worker_flag_values, conftest._SerializeSetFlags(flag_values)) == []
+  assert not worker_flag_values.foo
+  assert worker_flag_values.bar == ['a', 'b']
+
+
+def test_ParseKnownFlags_deferred_parse(flag_values: absl_flags.FlagValues):
+  """Test that flags which are defined later are parsed in a second phase."""
+  absl_flags.DEFINE_string('foo', 'a', 'Foo.', flag_values=flag_values)
+  args = ['--bar=c', '--foo=b', '--nobaz']
+
+  # The flags which are not yet defined are returned.
+  unparsed_args = conftest._ParseKnownFlags(flag_values, args)
+  assert flag_values.foo == 'b'
+  assert unparsed_args == ['--bar=c', '--nobaz']
+
+  # The flags are defined during collection, and then parsed.
+  absl_flags.DEFINE_string('bar', None, 'Bar.', flag_values=flag_values)
+  absl_flags.DEFINE_boolean('baz', True, 'Baz.', flag_values=flag_values)
+  assert conftest._ParseKnownFlags(flag_values, unparsed_args) == []
+  assert flag_values.bar == 'c'
+  assert not flag_values.baz
+
+
+def test_ParseKnownFlags_undefined_flags_ignored(
+    flag_values: absl_flags.FlagValues):
+  """Test that flags which are never defined do not cause an error."""
+  absl_flags.DEFINE_string('foo', 'a', 'Foo.', flag_values=flag_values)
+  assert conftest._ParseKnownFlags(flag_values, ['--bar=c']) == ['--bar=c']
+  assert flag_values.foo == 'a'
+
+
+if __name__ == '__main__':
+  test.Main()
@@ -96,5 +96,59 @@ public class HelloWorld {
 """
 
 
+def test_preprocess_image_exec_context_smoke_test(
+    preprocess: dockerutil.BazelPy3Image):
+  """Check that image doesn't blow up when run in a long-lived container."""
+  with preprocess.ExecContext() as ctx:
+    ctx.CheckCall(['--version'], timeout=30)
+
+
+def test_preprocess_image_exec_context_multiple_calls(
+    preprocess: dockerutil.BazelPy3Image):
+  """Check that a long-lived container can be invoked more than once."""
+  with preprocess.ExecContext() as ctx:
+    version = ctx.CheckOutput(['--version'], timeout=30)
+    assert ctx.CheckOutput(['--version'], timeout=30) == version
+
+
+def test_preprocess_image_exec_context_volumes_on_call(
+    tempdir: pathlib.Path, preprocess: dockerutil.BazelPy3Image):
+  """Check that volumes cannot be mounted in a running container."""
+  with preprocess.ExecContext() as ctx:
+    with pytest.raises(ValueError) as e_ctx:
+      ctx.CheckCall(['--version'], volumes={tempdir: '/tmp/foo'})
+  assert str(e_ctx.value) == (
+      'Volumes must be declared when creating an exec context')
+
+
+def test_cxx_preprocess_exec_context(contentfiles: pathlib.Path,
+                                     tempdir2: pathlib.Path,
+                                     preprocess: dockerutil.BazelPy3Image):
+  """Test pre-processing C++ contentfiles in a long-lived container."""
+  with preprocess.ExecContext(volumes={
+      contentfiles: '/contentfiles',
+      tempdir2: '/preprocessed'
+  }) as ctx:
+    ctx.CheckCall(
+        [], {
+            'contentfiles':
+            '/contentfiles',
+            'outdir':
+            '/preprocessed',
+            'preprocessors':
+            ("deeplearning.clgen.preprocessors.cxx:Compile,"
+             "deeplearning.clgen.preprocessors.cxx:NormalizeIdentifiers,"
+             "deeplearning.clgen.preprocessors.cxx:StripComments,"
+             "deeplearning.clgen.preprocessors.cxx:ClangFormat")
+        })
+
+  assert (tempdir2 / 'a.cc').is_file()
+  assert not (tempdir2 / 'b.java').is_file()
+
+  with open(tempdir2 / 'a.cc') as f:
+    assert f.read() == """int A() {
+}"""
+
+
 if __name__ == '__main__':
   test.Main()
@@ -95,9 +95,10 @@ class Model(object):
           os.path.relpath(self.corpus.atomizer_path, self.cache.path), symlink)
 
     # Validate metadata against cache.
-    if self.cache.get('META.pbtxt'):
-      cached_meta = pbutil.FromFile(
-          pathlib.Path(self.cache['META.pbtxt']), internal_pb2.ModelMeta())
+    cached_meta_path = self.cache.get('META.pbtxt')
+    if cached_meta_path:
+      cached_meta = pbutil.FromFile(pathlib.Path(cached_meta_path),
+                                    internal_pb2.ModelMeta())
       # Exclude num_epochs and corpus location from metadata comparison.
       config_to_compare = model_pb2.Model()
       config_to_compare.CopyFrom(self.config)
@@ -142,9 +143,13 @@ class Model(object):
     Returns:
       The unique model ID.
     """
+    # Copy only the fields which contribute to the hash, rather than copying
+    # the entire config and then clearing the corpus. The architecture and
+    # training fields are guaranteed to be set by AssertIsBuildable(), so the
+    # serialized form is identical to that of a full copy.
     config_to_hash = model_pb2.Model()
-    config_to_hash.CopyFrom(config)
-    config_to_hash.ClearField('corpus')
+    config_to_hash.architecture.CopyFrom(config.architecture)
+    config_to_hash.training.CopyFrom(config.training)
     config_to_hash.training.ClearField('num_epochs')
     return crypto.sha1_list(corpus_.hash, config_to_hash.SerializeToString())
 
@@ -13,15 +13,15 @@
 # You should have received a copy of the GNU General Public License
 # along with clgen.  If not, see <https://www.gnu.org/licenses/>.
 """CLgen models using a Keras backend."""
-import copy
+import concurrent.futures
 import os
 import pathlib
 import time
 import typing
 
 import numpy as np
-import progressbar
 
+from deeplearning.clgen import errors
 from deeplearning.clgen import samplers
 from deeplearning.clgen import telemetry
 from deeplearning.clgen.models import backends
@@ -39,6 +39,52 @@ app.DEFINE_boolean(
 app.DEFINE_integer(
     'clgen_tf_backend_tensorboard_summary_step_count', 10,
     'The number of steps between writing tensorboard summaries.')
+app.DEFINE_integer(
+    'clgen_tf_backend_sampled_softmax_min_vocab_size', 4096,
+    'Models with a vocabulary larger than this are trained using a sampled '
+    'softmax loss, rather than a softmax over the full vocabulary. The loss '
+    'which is logged and recorded in telemetry is always the full softmax '
+    'cross-entropy.')
+app.DEFINE_integer(
+    'clgen_tf_backend_sampled_softmax_num_samples',
+    512,
+    'The number of vocabulary entries to sample per batch when training using '
+    'a sampled softmax loss.',
+    lower_bound=1)
+app.DEFINE_integer(
+    'clgen_tf_backend_num_gpus',
+    1,
+    'The number of GPUs to train on. Each training batch is split evenly '
+    'between the GPUs, so the batch size must be a multiple of this value.',
+    lower_bound=1)
+app.DEFINE_boolean(
+    'clgen_tf_backend_mixed_precision', False,
+    'If set, train using automatic mixed precision, with float16 computation '
+    'and dynamic loss scaling. This requires a GPU with float16 support. The '
+    'flag may be changed when resuming training from a checkpoint, in which '
+    'case the loss scale starts afresh.')
+
+# The names of the variables which a MixedPrecisionLossScaleOptimizer with a
+# dynamic loss scale adds to the graph. Graph variable names may be given a
+# numeric suffix to make them unique.
+_LOSS_SCALE_VARIABLE_NAMES = {'current_loss_scale', 'good_steps'}
+
+
+def _CopyState(state):
+  """Copy a network state, as returned by a session run.
+
+  The state is a nested structure of lists and (named) tuples of numpy arrays.
+  This is much cheaper than a copy.deepcopy(), which must reflect over every
+  object in the structure.
+  """
+  if isinstance(state, np.ndarray):
+    return state.copy()
+  elif isinstance(state, tuple) and hasattr(state, '_fields'):
+    return type(state)(*[_CopyState(s) for s in state])
+  elif isinstance(state, (list, tuple)):
+    return type(state)([_CopyState(s) for s in state])
+  else:
+    return state
 
 
 class TensorFlowBackend(backends.BackendBase):
@@ -68,6 +114,9 @@ class TensorFlowBackend(backends.BackendBase):
     self.learning_rate = None
     self.epoch = None
     self.train_op = None
+    self.report_train_op = None
+    self.reset_state_op = None
+    self.init_batches_op = None
 
     self.inference_tf = None
     self.inference_sess = None
@@ -83,8 +132,11 @@ class TensorFlowBackend(backends.BackendBase):
         f"    $ tensorboard --logdir='{tensorboard_dir}'")
     self.summary_writer = tf.summary.FileWriter(tensorboard_dir, graph=None)
 
-  def InitTfGraph(self,
-                  sampler: typing.Optional[samplers.Sampler] = None) -> 'tf':
+  def InitTfGraph(
+      self,
+      sampler: typing.Optional[samplers.Sampler] = None,
+      data_generator: typing.Optional[
+          data_generators.TensorflowBatchGenerator] = None) -> 'tf':
     """Instantiate a TensorFlow graph for training or inference.
 
     The tensorflow graph is different for training and inference, so must be
@@ -93,6 +145,8 @@ class TensorFlowBackend(backends.BackendBase):
     Args:
       sampler: If set, initialize the model for inference using the given
         sampler. If not set, initialize model for training.
+      data_generator: The source of training batches. Required if sampler is
+        not set.
 
     Returns:
       The imported TensorFlow module.
@@ -128,66 +182,224 @@ class TensorFlowBackend(backends.BackendBase):
       batch_size = self.config.training.batch_size
     vocab_size = self.atomizer.vocab_size
 
-    cells_lst = []
-    for _ in range(self.config.architecture.num_layers):
-      cells_lst.append(cell_type(self.config.architecture.neurons_per_layer))
+    # Each layer must be a distinct cell instance so that it owns its own
+    # variables. Replicating a single cell object across layers would share
+    # weights between layers.
+    cells_lst = [
+        cell_type(self.config.architecture.neurons_per_layer)
+        for _ in range(self.config.architecture.num_layers)
+    ]
     self.cell = cell = rnn.MultiRNNCell(cells_lst, state_is_tuple=True)
 
-    self.input_data = tf.placeholder(tf.int32, [batch_size, sequence_length])
-    self.targets = tf.placeholder(tf.int32, [batch_size, sequence_length])
-    self.initial_state = self.cell.zero_state(batch_size, tf.float32)
-    self.temperature = tf.Variable(1.0, trainable=False)
-    self.seed_length = tf.Variable(32, trainable=False)
-
     if sampler:
-      self.lengths = tf.placeholder(tf.int32, [batch_size])
+      self.input_data = tf.placeholder(tf.int32, [batch_size, sequence_length])
+      self.targets = tf.placeholder(tf.int32, [batch_size, sequence_length])
     else:
-      self.lengths = tf.fill([batch_size], sequence_length)
+      # Training batches are streamed from the data generator through a tf.data
+      # pipeline, which prepares the next batch while the current one is being
+      # processed, rather than being copied in through a feed dict. The
+      # iterator must be initialized at the start of every epoch.
+      def _EpochBatches():
+        for _ in range(data_generator.num_batches):
+          yield data_generator.NextBatch()
+
+      dataset = tf.data.Dataset.from_generator(
+          _EpochBatches, (tf.int32, tf.int32),
+          ([batch_size, sequence_length], [batch_size, sequence_length]))
+      dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+      iterator = dataset.make_initializable_iterator()
+      self.input_data, self.targets = iterator.get_next()
+      self.init_batches_op = iterator.initializer
+    self.temperature = tf.Variable(1.0, trainable=False)
+    self.seed_length = tf.Variable(32, trainable=False)
 
     scope_name = 'rnnlm'
+    # The embedding table is placed alongside the rest of the model, rather
+    # than pinned to the CPU, so that the lookup is a device-local gather and
+    # does not require a host to device copy of the embedded inputs every step.
     with tf.variable_scope(scope_name):
-      with tf.device('/cpu:0'):
-        embedding = tf.get_variable(
-            'embedding',
-            [vocab_size, self.config.architecture.neurons_per_layer])
-        inputs = tf.nn.embedding_lookup(embedding, self.input_data)
+      embedding = tf.get_variable(
+          'embedding', [vocab_size, self.config.architecture.neurons_per_layer])
 
     if sampler:
+      self.lengths = tf.placeholder(tf.int32, [batch_size])
+      self.initial_state = self.cell.zero_state(batch_size, tf.float32)
+      inputs = tf.nn.embedding_lookup(embedding, self.input_data)
       decode_helper = helper.CustomInferenceHelper(
           inputs, self.lengths, self.seed_length, embedding, self.temperature)
+      decoder = seq2seq.BasicDecoder(cell, decode_helper, self.initial_state,
+                                     tf.layers.Dense(vocab_size))
+      outputs, self.final_state, _ = seq2seq.dynamic_decode(
+          decoder,
+          output_time_major=False,
+          impute_finished=True,
+          swap_memory=True,
+          scope=scope_name)
+      self.generated = outputs.sample_id
+      self.logits = outputs.rnn_output
+      sequence_weigths = tf.ones([batch_size, sequence_length])
+      tower_losses = [
+          seq2seq.sequence_loss(self.logits, self.targets, sequence_weigths)
+      ]
+      tower_train_losses = tower_losses
     else:
-      decode_helper = seq2seq.TrainingHelper(
-          inputs, self.lengths, time_major=False)
-
-    decoder = seq2seq.BasicDecoder(cell, decode_helper, self.initial_state,
-                                   tf.layers.Dense(vocab_size))
-    outputs, self.final_state, _ = seq2seq.dynamic_decode(
-        decoder,
-        output_time_major=False,
-        impute_finished=True,
-        swap_memory=True,
-        scope=scope_name)
-
-    self.generated = outputs.sample_id
-    self.logits = outputs.rnn_output
-
-    sequence_weigths = tf.ones([batch_size, sequence_length])
-    self.loss = seq2seq.sequence_loss(self.logits, self.targets,
-                                      sequence_weigths)
+      # Data parallel training. Each batch is split evenly between towers, one
+      # per device. The towers share variables, and their gradients are
+      # averaged before being applied.
+      num_towers = FLAGS.clgen_tf_backend_num_gpus
+      if batch_size % num_towers:
+        raise errors.UserError(
+            f'TrainingOptions.batch_size ({batch_size}) must be a multiple of '
+            f'--clgen_tf_backend_num_gpus ({num_towers})')
+      tower_batch_size = batch_size // num_towers
+
+      # For large vocabularies the output projection over the full vocabulary
+      # dominates the cost of a training step. Compute the gradients from a
+      # loss which is approximated using a random sample of the vocabulary. The
+      # exact loss is still reported, and the full logits are still available
+      # for inference, since the projection weights are shared.
+      use_sampled_softmax = (
+          vocab_size > FLAGS.clgen_tf_backend_sampled_softmax_min_vocab_size)
+      num_sampled = FLAGS.clgen_tf_backend_sampled_softmax_num_samples
+      if use_sampled_softmax and num_sampled >= vocab_size:
+        raise errors.UserError(
+            f'--clgen_tf_backend_sampled_softmax_num_samples ({num_sampled}) '
+            f'must be less than the vocabulary size ({vocab_size})')
+
+      output_layer = tf.layers.Dense(vocab_size)
+      tower_losses, tower_train_losses, tower_logits = [], [], []
+      state_variables, final_states = [], []
+      for i, (tower_input_data, tower_targets) in enumerate(
+          zip(tf.split(self.input_data, num_towers),
+              tf.split(self.targets, num_towers))):
+        with tf.device(f'/gpu:{i}' if num_towers > 1 else None):
+          with tf.name_scope(f'tower_{i}'):
+            # During training the network state is carried over between
+            # batches. The state is stored in local (non-checkpointed)
+            # variables so that it does not have to be fetched and fed back in
+            # by the training loop at every step. The variables are explicitly
+            # named so that they do not displace the default names of the
+            # checkpointed variables created below.
+            zero_state = self.cell.zero_state(tower_batch_size, tf.float32)
+            tower_state_variables = [
+                tf.Variable(s,
+                            trainable=False,
+                            collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                            name='rnn_state')
+                for s in tf.nest.flatten(zero_state)
+            ]
+            state_variables += tower_state_variables
+
+            # During training the full input sequence is known ahead of time,
+            # so there is no need for the per-step helper machinery of a
+            # seq2seq decoder. Run the cell over the whole sequence using
+            # dynamic_rnn() and apply the output projection to all timesteps
+            # at once. The variable scopes match those created by
+            # dynamic_decode() above, so checkpoints written during training
+            # can be restored by the inference graph.
+            inputs = tf.nn.embedding_lookup(embedding, tower_input_data)
+            outputs, final_state = tf.nn.dynamic_rnn(
+                cell,
+                inputs,
+                initial_state=tf.nest.pack_sequence_as(zero_state,
+                                                       tower_state_variables),
+                dtype=tf.float32,
+                swap_memory=True,
+                scope=scope_name)
+            final_states += tf.nest.flatten(final_state)
+            with tf.variable_scope(scope_name):
+              tower_logits.append(output_layer(outputs))
+
+            sequence_weigths = tf.ones([tower_batch_size, sequence_length])
+            tower_losses.append(
+                seq2seq.sequence_loss(tower_logits[-1], tower_targets,
+                                      sequence_weigths))
+            if use_sampled_softmax:
+              tower_train_losses.append(
+                  tf.reduce_mean(
+                      tf.nn.sampled_softmax_loss(
+                          weights=tf.transpose(output_layer.kernel),
+                          biases=output_layer.bias,
+                          labels=tf.reshape(tower_targets, [-1, 1]),
+                          inputs=tf.reshape(outputs, [
+                              -1, self.config.architecture.neurons_per_layer
+                          ]),
+                          num_sampled=num_sampled,
+                          num_classes=vocab_size)))
+            else:
+              tower_train_losses.append(tower_losses[-1])
+
+      self.reset_state_op = tf.variables_initializer(state_variables)
+      self.logits = tf.concat(tower_logits, 0)
+      self.generated = tf.argmax(self.logits, axis=2, output_type=tf.int32)
+
+    self.loss = tf.add_n(tower_losses) / len(tower_losses)
 
     self.learning_rate = tf.Variable(0.0, trainable=False)
     self.epoch = tf.Variable(0, trainable=False)
     trainable_variables = tf.trainable_variables()
 
     # TODO(cec): Support non-adam optimizers.
+    optimizer = tf.train.AdamOptimizer(self.learning_rate)
+    if not sampler and FLAGS.clgen_tf_backend_mixed_precision:
+      # Wrap the optimizer with dynamic loss scaling so that small float16
+      # gradients do not underflow. The cast of eligible ops to float16 is
+      # enabled by the training session's config in Train(), rather than by
+      # enable_mixed_precision_graph_rewrite(), which would set process-global
+      # state that also rewrites the sampling sessions. Variables remain
+      # float32.
+      optimizer = tf.train.experimental.MixedPrecisionLossScaleOptimizer(
+          optimizer, 'dynamic')
+    # Compute the gradients of each tower on the tower's own device, then
+    # average them. The sparse embedding gradients must be densified before
+    # they can be summed.
+    tower_grads = [[
+        grad for grad, _ in optimizer.compute_gradients(
+            loss,
+            trainable_variables,
+            aggregation_method=2,
+            colocate_gradients_with_ops=True)
+    ] for loss in tower_train_losses]
+    grads = [
+        var_grads[0] if len(var_grads) == 1 or var_grads[0] is None else
+        tf.add_n([tf.convert_to_tensor(g) for g in var_grads]) / len(var_grads)
+        for var_grads in zip(*tower_grads)
+    ]
     grads, _ = tf.clip_by_global_norm(
-        tf.gradients(self.loss, trainable_variables, aggregation_method=2),
+        grads,
         self.config.training.adam_optimizer.normalized_gradient_clip_micros /
         1e6)
-    optimizer = tf.train.AdamOptimizer(self.learning_rate)
     self.train_op = optimizer.apply_gradients(zip(grads, trainable_variables))
+    self.report_train_op = self.train_op
 
     if not sampler:
+      if use_sampled_softmax:
+        # The gradients of the sampled loss do not depend on the full softmax
+        # loss, so nothing orders the reported loss before the in-place update
+        # of the output projection weights. Steps which report the loss run a
+        # second apply op, whose gradients are only available once the loss
+        # has been computed, so that the loss is that of the weights before
+        # the update. The optimizer's slots are shared by both apply ops.
+        with tf.control_dependencies([self.loss]):
+          report_grads = [
+              None if grad is None else tf.identity(grad) for grad in grads
+          ]
+        self.report_train_op = optimizer.apply_gradients(
+            zip(report_grads, trainable_variables))
+
+      # Once the weights have been updated, store the final state of this
+      # batch as the initial state of the next.
+      def _CarryStateAfter(train_op):
+        with tf.control_dependencies([train_op]):
+          return tf.group(*[
+              tf.assign(variable, value)
+              for variable, value in zip(state_variables, final_states)
+          ])
+
+      self.train_op = _CarryStateAfter(self.train_op)
+      self.report_train_op = (_CarryStateAfter(self.report_train_op)
+                              if use_sampled_softmax else self.train_op)
+
       # Create tensorboard summary writers for training progress.
       tf.summary.scalar('loss', self.loss)
       tf.summary.scalar('learning_rate', self.learning_rate)
@@ -235,11 +447,18 @@ class TensorFlowBackend(backends.BackendBase):
         for p in checkpoint_state.all_model_checkpoint_paths
     ]
     # The checkpoint paths are appended with the epoch number.
-    epoch_nums = [int(x.split('-')[-1]) for x in paths]
-    diffs = [self.config.training.num_epochs - e for e in epoch_nums]
-    pairs = zip(paths, diffs)
-    positive_only = [p for p in pairs if p[1] >= 0]
-    return min(positive_only, key=lambda x: x[1])[0], paths
+    epoch_nums = np.fromiter((int(x.rsplit('-', 1)[1]) for x in paths),
+                             dtype=np.int64,
+                             count=len(paths))
+    # Find the checkpoint with the largest epoch number that does not exceed
+    # the target number of epochs.
+    order = np.argsort(epoch_nums)
+    i = np.searchsorted(epoch_nums[order],
+                        self.config.training.num_epochs,
+                        side='right') - 1
+    if i < 0:
+      return None, paths
+    return paths[order[i]], paths
 
   def InferenceManifest(self) -> typing.List[pathlib.Path]:
     """Return the list of files which are required for model inference.
@@ -288,9 +507,13 @@ class TensorFlowBackend(backends.BackendBase):
     if self.is_trained:
       return
 
+    # Like tensorflow, progressbar is only needed for training, so it is
+    # imported here rather than at module load.
+    import progressbar
+
     data_generator = data_generators.TensorflowBatchGenerator(
         corpus, self.config.training)
-    tf = self.InitTfGraph()
+    tf = self.InitTfGraph(data_generator=data_generator)
 
     logger = telemetry.TrainingLogger(self.cache.path / 'logs')
 
@@ -314,7 +537,23 @@ class TensorFlowBackend(backends.BackendBase):
       assert checkpoint_state.model_checkpoint_path
       ckpt_path, ckpt_paths = self.GetParamsPath(checkpoint_state)
 
-    with tf.Session() as sess:
+    # Checkpoints are written by a background thread, so that the next epoch's
+    # batches can be created while the checkpoint is being written. A pending
+    # save must complete before the model is next modified, and before the
+    # session is closed.
+    save_future = None
+    # Some ops only have CPU kernels, such as the candidate sampler of the
+    # sampled softmax loss. Soft placement lets them run on the CPU when they
+    # are built inside a GPU tower.
+    config = tf.ConfigProto(allow_soft_placement=True)
+    if FLAGS.clgen_tf_backend_mixed_precision:
+      # Cast eligible ops to float16. This applies to this session only, so the
+      # sampling sessions are unaffected.
+      from tensorflow.core.protobuf import rewriter_config_pb2
+      config.graph_options.rewrite_options.auto_mixed_precision = (
+          rewriter_config_pb2.RewriterConfig.ON)
+    with tf.Session(config=config) as sess, \
+        concurrent.futures.ThreadPoolExecutor(max_workers=1) as save_executor:
       tf.global_variables_initializer().run()
 
       # Keep all checkpoints.
@@ -324,7 +563,7 @@ class TensorFlowBackend(backends.BackendBase):
       # restore model from closest checkpoint.
       if ckpt_path:
         app.Log(1, "Restoring checkpoint {}".format(ckpt_path))
-        saver.restore(sess, ckpt_path)
+        self._RestoreCheckpoint(tf, sess, ckpt_path)
 
       # make sure we don't lose track of other checkpoints
       if ckpt_paths:
@@ -338,46 +577,53 @@ class TensorFlowBackend(backends.BackendBase):
       for epoch_num in range(current_epoch, max_epoch):
         logger.EpochBeginCallback()
 
+        # TODO(cec): refactor data generator to a Python generator.
+        data_generator.CreateBatches()
+
+        if save_future:
+          save_future.result()
+
         # decay and set learning rate
         new_learning_rate = initial_learning_rate * (
             (float(100 - decay_rate) / 100.0)**(epoch_num - 1))
-        sess.run(tf.assign(self.learning_rate, new_learning_rate))
-        sess.run(tf.assign(self.epoch, epoch_num))
-
-        # TODO(cec): refactor data generator to a Python generator.
-        data_generator.CreateBatches()
+        self.learning_rate.load(new_learning_rate, sess)
+        self.epoch.load(epoch_num, sess)
 
         app.Log(1, 'Epoch %d/%d:', epoch_num, self.config.training.num_epochs)
-        state = sess.run(self.initial_state)
+        sess.run([self.reset_state_op, self.init_batches_op])
         # Per-batch inner loop.
-        bar = progressbar.ProgressBar(max_value=data_generator.num_batches)
-        for i in bar(range(data_generator.num_batches)):
-          x, y = data_generator.NextBatch()
-          feed = {self.input_data: x, self.targets: y}
-          for j, (c, h) in enumerate(self.initial_state):
-            feed[c], feed[h] = state[j].c, state[j].h
-          summary, loss, state, _ = sess.run(
-              [merged, self.loss, self.final_state, self.train_op], feed)
+        num_batches = data_generator.num_batches
+        epoch_step = (epoch_num - 1) * num_batches
+        summary_step_count = (
+            FLAGS.clgen_tf_backend_tensorboard_summary_step_count)
+        bar = progressbar.ProgressBar(max_value=num_batches).start()
+        for i in range(num_batches):
+          # The loss is only evaluated when it is reported, since when training
+          # with a sampled softmax it requires the otherwise unused projection
+          # over the full vocabulary.
+          is_summary_step = i % summary_step_count == 0
+          if is_summary_step or i == num_batches - 1:
+            summary, loss, _ = sess.run(
+                [merged, self.loss, self.report_train_op])
+          else:
+            sess.run(self.train_op)
 
           # Periodically write progress to tensorboard.
-          if i % FLAGS.clgen_tf_backend_tensorboard_summary_step_count == 0:
-            step = (epoch_num - 1) * data_generator.num_batches + i
+          if is_summary_step:
+            step = epoch_step + i
             self.summary_writer.add_summary(summary, step)
 
+          # Updating the progress bar is not free, so only do so periodically.
+          if not i & 31:
+            bar.update(i)
+        bar.finish()
+
         # Log the loss and delta.
         app.Log(1, 'Loss: %.6f.', loss)
 
         # Save after every epoch.
-        start_time = time.time()
-        global_step = epoch_num
-        checkpoint_prefix = (self.cache.path / 'checkpoints' / 'checkpoint')
-        checkpoint_path = saver.save(
-            sess, checkpoint_prefix, global_step=global_step)
-        app.Log(1, 'Saved checkpoint %s in %s ms.', checkpoint_path,
-                humanize.Commas(int((time.time() - start_time) * 1000)))
-        assert pathlib.Path(
-            f'{checkpoint_prefix}-{global_step}.index').is_file()
-        assert pathlib.Path(f'{checkpoint_prefix}-{global_step}.meta').is_file()
+        save_future = save_executor.submit(self._SaveCheckpoint, sess, saver,
+                                           epoch_num)
 
         logger.EpochEndCallback(epoch_num, loss)
         # If we have a sampler that we can use at the end of epochs, then
@@ -385,12 +631,71 @@ class TensorFlowBackend(backends.BackendBase):
         if test_sampler:
           break
       else:
+        if save_future:
+          save_future.result()
         return
 
+      if save_future:
+        save_future.result()
+
     if test_sampler:
       self._EndOfEpochTestSample(corpus, test_sampler, step)
       self.Train(corpus, test_sampler)
 
+  @staticmethod
+  def _RestoreCheckpoint(tf, sess, ckpt_path: str) -> None:
+    """Restore the training graph's variables from a checkpoint.
+
+    The loss scale variables of --clgen_tf_backend_mixed_precision are missing
+    from checkpoints written without the flag, so they keep their initial
+    values if they are not in the checkpoint. Any other missing variable is an
+    error.
+
+    Args:
+      tf: The imported TensorFlow module.
+      sess: The session to restore.
+      ckpt_path: The path of the checkpoint.
+
+    Raises:
+      InternalError: If a variable other than the loss scale variables is
+        missing from the checkpoint.
+    """
+    checkpoint_variable_names = {
+        name for name, _ in tf.train.list_variables(ckpt_path)
+    }
+    restore_variables, missing_variable_names = [], []
+    for variable in tf.global_variables():
+      if variable.op.name in checkpoint_variable_names:
+        restore_variables.append(variable)
+      elif (variable.op.name.rstrip('_0123456789') in
+            _LOSS_SCALE_VARIABLE_NAMES):
+        app.Log(1, 'Variable %s is not in checkpoint, not restoring it',
+                variable.op.name)
+      else:
+        missing_variable_names.append(variable.op.name)
+    if missing_variable_names:
+      raise errors.InternalError(
+          f"Variables missing from checkpoint {ckpt_path}: "
+          f"{', '.join(missing_variable_names)}")
+    tf.train.Saver(restore_variables).restore(sess, ckpt_path)
+
+  def _SaveCheckpoint(self, sess, saver, global_step: int) -> None:
+    """Save a checkpoint of the model.
+
+    Args:
+      sess: The session to save.
+      saver: The saver to save with.
+      global_step: The epoch number of the checkpoint.
+    """
+    start_time = time.time()
+    checkpoint_prefix = (self.cache.path / 'checkpoints' / 'checkpoint')
+    checkpoint_path = saver.save(
+        sess, checkpoint_prefix, global_step=global_step)
+    app.Log(1, 'Saved checkpoint %s in %s ms.', checkpoint_path,
+            humanize.Commas(int((time.time() - start_time) * 1000)))
+    assert pathlib.Path(f'{checkpoint_prefix}-{global_step}.index').is_file()
+    assert pathlib.Path(f'{checkpoint_prefix}-{global_step}.meta').is_file()
+
   def _EndOfEpochTestSample(self, corpus, sampler: samplers.Sampler, step: int):
     """Run sampler"""
     import tensorflow as tf
@@ -433,7 +738,6 @@ class TensorFlowBackend(backends.BackendBase):
                    sampler: samplers.Sampler,
                    seed: typing.Optional[int] = None) -> None:
     """Initialize model for sampling."""
-    import tensorflow as tf
     # Delete any previous sampling session.
     if self.inference_tf:
       del self.inference_tf
@@ -451,8 +755,7 @@ class TensorFlowBackend(backends.BackendBase):
     # If --clgen_tf_backend_reset_inference_state_between_batches, the state
     # is reset at the beginning of every sample batch. Else, this is the only
     # place it is initialized.
-    self.inference_state = self.inference_sess.run(
-        self.cell.zero_state(sampler.batch_size, self.inference_tf.float32))
+    self.inference_state = self.inference_sess.run(self.initial_state)
 
     self.inference_tf.global_variables_initializer().run(
         session=self.inference_sess)
@@ -468,12 +771,11 @@ class TensorFlowBackend(backends.BackendBase):
     assert checkpoint_state.model_checkpoint_path
 
     saver.restore(self.inference_sess, checkpoint_state.model_checkpoint_path)
-    self.inference_sess.run(tf.assign(self.temperature, sampler.temperature))
+    self.temperature.load(sampler.temperature, self.inference_sess)
 
   def InitSampleBatch(self, sampler: samplers.Sampler) -> None:
     if FLAGS.clgen_tf_backend_reset_inference_state_between_batches:
-      self.inference_state = self.inference_sess.run(
-          self.cell.zero_state(sampler.batch_size, self.inference_tf.float32))
+      self.inference_state = self.inference_sess.run(self.initial_state)
     self.inference_indices = np.tile(sampler.encoded_start_text,
                                      [sampler.batch_size, 1])
 
@@ -508,7 +810,7 @@ class TensorFlowBackend(backends.BackendBase):
     ]
 
   def ResetSampleState(self, sampler: samplers.Sampler, state, seed) -> None:
-    self.inference_state = copy.deepcopy(state)
+    self.inference_state = _CopyState(state)
     self.inference_indices = np.tile(seed, [sampler.batch_size, 1])
 
   def EvaluateSampleState(self, sampler: samplers.Sampler):
@@ -532,7 +834,7 @@ class TensorFlowBackend(backends.BackendBase):
     self.inference_state = self.inference_sess.run([self.final_state], feed)
     self.inference_indices = last_indices
 
-    state_copy = copy.deepcopy(self.inference_state)
+    state_copy = _CopyState(self.inference_state)
     input_carry_copy = self.inference_indices[0]
     return state_copy, input_carry_copy
 
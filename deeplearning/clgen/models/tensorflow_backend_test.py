@@ -13,13 +13,16 @@
 # You should have received a copy of the GNU General Public License
 # along with clgen.  If not, see <https://www.gnu.org/licenses/>.
 """Unit tests for //deeplearning/clgen/models/tensorflow_backend.py."""
+import pathlib
 
 import checksumdir
 import numpy as np
 import pytest
 
+from deeplearning.clgen import errors
 from deeplearning.clgen import sample_observers
 from deeplearning.clgen.models import models
+from deeplearning.clgen.models import tensorflow_backend
 from deeplearning.clgen.proto import model_pb2
 from deeplearning.clgen.proto import telemetry_pb2
 from labm8 import app
@@ -138,6 +141,36 @@ def test_TensorFlowBackend_Train_missing_intermediate_checkpoints(
   assert f1a == f1b
 
 
+def test_TensorFlowBackend_Train_all_checkpoints_past_target_epoch(
+    clgen_cache_dir, abc_tensorflow_model_config):
+  """Test that a model is retrained if all checkpoints are past the target."""
+  del clgen_cache_dir
+  abc_tensorflow_model_config.training.num_epochs = 2
+  m = models.Model(abc_tensorflow_model_config)
+  m.Train()
+  assert 2 == len(m.backend.epoch_checkpoints)
+
+  # Remove the epoch 1 checkpoint, and the record of it in the checkpoints
+  # list, leaving only the epoch 2 checkpoint.
+  checkpoints_dir = (m.cache.path / 'checkpoints')
+  for path in checkpoints_dir.iterdir():
+    if path.name.startswith('checkpoint-1'):
+      path.unlink()
+  (checkpoints_dir / 'checkpoint').write_text(
+      'model_checkpoint_path: "checkpoint-2"\n'
+      'all_model_checkpoint_paths: "checkpoint-2"\n')
+  assert {2} == m.backend.epoch_checkpoints
+
+  # The epoch 2 checkpoint cannot be used to train a model for 1 epoch, so the
+  # model is trained from scratch.
+  abc_tensorflow_model_config.training.num_epochs = 1
+  m = models.Model(abc_tensorflow_model_config)
+  assert not m.is_trained
+  m.Train()
+  assert m.is_trained
+  assert {1, 2} == m.backend.epoch_checkpoints
+
+
 def test_TensorFlowBackend_Train_is_trained(clgen_cache_dir,
                                             abc_tensorflow_model_config):
   """Test that is_trained is initially false until trained."""
@@ -159,6 +192,165 @@ def test_TensorFlowBackend_Train_with_sample_callback(
   assert m.is_trained
 
 
+def test_TensorFlowBackend_Train_batch_size_not_divisible_by_num_gpus(
+    clgen_cache_dir, abc_tensorflow_model_config, monkeypatch):
+  """Test that an error is raised if the batch cannot be split between GPUs."""
+  del clgen_cache_dir
+  abc_tensorflow_model_config.training.batch_size = 5
+  monkeypatch.setattr(FLAGS, 'clgen_tf_backend_num_gpus', 2)
+  m = models.Model(abc_tensorflow_model_config)
+  with pytest.raises(errors.UserError) as e_ctx:
+    m.Train()
+  assert str(e_ctx.value) == (
+      'TrainingOptions.batch_size (5) must be a multiple of '
+      '--clgen_tf_backend_num_gpus (2)')
+
+
+def test_TensorFlowBackend_Train_multiple_gpus(clgen_cache_dir,
+                                               abc_tensorflow_model_config,
+                                               monkeypatch):
+  """Test training with multiple towers, and sampling the trained model.
+
+  Soft placement lets the towers run on the CPU when there are not enough
+  GPUs. Sampling checks that the checkpoints written by the multi-tower
+  training graph restore into the single-device inference graph.
+  """
+  del clgen_cache_dir
+  monkeypatch.setattr(FLAGS, 'clgen_tf_backend_num_gpus', 2)
+  abc_tensorflow_model_config.training.batch_size = 4
+  abc_tensorflow_model_config.training.num_epochs = 2
+  m = models.Model(abc_tensorflow_model_config)
+  m.Train()
+  assert m.is_trained
+  assert {1, 2} == m.backend.epoch_checkpoints
+  sample_observer = sample_observers.InMemorySampleSaver()
+  m.Sample(MockSampler(),
+           [sample_observers.MaxSampleCountObserver(1), sample_observer])
+  assert len(sample_observer.samples) == 1
+
+
+def test_TensorFlowBackend_Train_sampled_softmax(clgen_cache_dir,
+                                                abc_tensorflow_model_config,
+                                                monkeypatch):
+  """Test training and sampling a model with a sampled softmax loss."""
+  del clgen_cache_dir
+  monkeypatch.setattr(FLAGS, 'clgen_tf_backend_sampled_softmax_min_vocab_size',
+                      1)
+  monkeypatch.setattr(FLAGS, 'clgen_tf_backend_sampled_softmax_num_samples', 4)
+  abc_tensorflow_model_config.training.num_epochs = 2
+  m = models.Model(abc_tensorflow_model_config)
+  m.Train()
+  assert m.is_trained
+  # The reported loss is the full softmax cross-entropy, not the sampled
+  # approximation used to compute gradients. A barely trained model is close
+  # to uniform over the vocabulary, so its full loss is close to log(vocab
+  # size), well above the log(num_samples + 1) of the sampled loss.
+  for telemetry in m.TrainingTelemetry():
+    assert telemetry.loss > np.log(4 + 1)
+  sample_observer = sample_observers.InMemorySampleSaver()
+  m.Sample(MockSampler(),
+           [sample_observers.MaxSampleCountObserver(1), sample_observer])
+  assert len(sample_observer.samples) == 1
+
+
+def test_TensorFlowBackend_Train_sampled_softmax_too_many_samples(
+    clgen_cache_dir, abc_tensorflow_model_config, monkeypatch):
+  """Test that an error is raised if more samples than the vocab are asked."""
+  del clgen_cache_dir
+  monkeypatch.setattr(FLAGS, 'clgen_tf_backend_sampled_softmax_min_vocab_size',
+                      1)
+  monkeypatch.setattr(FLAGS, 'clgen_tf_backend_sampled_softmax_num_samples',
+                      1000)
+  m = models.Model(abc_tensorflow_model_config)
+  with pytest.raises(errors.UserError) as e_ctx:
+    m.Train()
+  assert str(e_ctx.value).startswith(
+      '--clgen_tf_backend_sampled_softmax_num_samples (1000) must be less '
+      'than the vocabulary size')
+
+
+def test_TensorFlowBackend_Train_mixed_precision(clgen_cache_dir,
+                                                abc_tensorflow_model_config,
+                                                monkeypatch):
+  """Test training and sampling a model with mixed precision.
+
+  The float16 rewrite is a no-op without a GPU, but the loss scale optimizer
+  is still used to compute, clip, and apply the gradients.
+  """
+  del clgen_cache_dir
+  monkeypatch.setattr(FLAGS, 'clgen_tf_backend_mixed_precision', True)
+  abc_tensorflow_model_config.training.num_epochs = 2
+  m = models.Model(abc_tensorflow_model_config)
+  m.Train()
+  assert m.is_trained
+  assert {1, 2} == m.backend.epoch_checkpoints
+  sample_observer = sample_observers.InMemorySampleSaver()
+  m.Sample(MockSampler(),
+           [sample_observers.MaxSampleCountObserver(1), sample_observer])
+  assert len(sample_observer.samples) == 1
+
+
+def test_TensorFlowBackend_Train_resume_with_mixed_precision(
+    clgen_cache_dir, abc_tensorflow_model_config, monkeypatch):
+  """Test resuming training with mixed precision from a float32 checkpoint."""
+  del clgen_cache_dir
+  abc_tensorflow_model_config.training.num_epochs = 1
+  m = models.Model(abc_tensorflow_model_config)
+  m.Train()
+  assert {1} == m.backend.epoch_checkpoints
+
+  # The checkpoint has no loss scale variables.
+  monkeypatch.setattr(FLAGS, 'clgen_tf_backend_mixed_precision', True)
+  abc_tensorflow_model_config.training.num_epochs = 2
+  m = models.Model(abc_tensorflow_model_config)
+  m.Train()
+  assert m.is_trained
+  assert {1, 2} == m.backend.epoch_checkpoints
+
+
+# TensorFlowBackend._RestoreCheckpoint() tests.
+
+
+def _WriteCheckpoint(path: pathlib.Path) -> str:
+  """Write a checkpoint of a graph with a single variable, 'a'."""
+  import tensorflow as tf
+  with tf.Graph().as_default(), tf.Session() as sess:
+    tf.Variable(1.0, name='a')
+    tf.global_variables_initializer().run()
+    return tf.train.Saver().save(sess, str(path / 'checkpoint'))
+
+
+def test_TensorFlowBackend_RestoreCheckpoint_missing_loss_scale_variables(
+    tempdir: pathlib.Path):
+  """Test that loss scale variables missing from a checkpoint are skipped."""
+  import tensorflow as tf
+  ckpt_path = _WriteCheckpoint(tempdir)
+  with tf.Graph().as_default(), tf.Session() as sess:
+    a = tf.Variable(0.0, name='a')
+    loss_scale = tf.Variable(2.0, name='current_loss_scale')
+    good_steps = tf.Variable(3, name='good_steps')
+    tf.global_variables_initializer().run()
+    tensorflow_backend.TensorFlowBackend._RestoreCheckpoint(
+        tf, sess, ckpt_path)
+    assert sess.run([a, loss_scale, good_steps]) == [1.0, 2.0, 3]
+
+
+def test_TensorFlowBackend_RestoreCheckpoint_missing_variable(
+    tempdir: pathlib.Path):
+  """Test that an error is raised if a model variable is missing."""
+  import tensorflow as tf
+  ckpt_path = _WriteCheckpoint(tempdir)
+  with tf.Graph().as_default(), tf.Session() as sess:
+    tf.Variable(0.0, name='a')
+    tf.Variable(0.0, name='b')
+    tf.global_variables_initializer().run()
+    with pytest.raises(errors.InternalError) as e_ctx:
+      tensorflow_backend.TensorFlowBackend._RestoreCheckpoint(
+          tf, sess, ckpt_path)
+  assert str(e_ctx.value) == (
+      f'Variables missing from checkpoint {ckpt_path}: b')
+
+
 # TODO(cec): Add test for InferenceManifest() contents of a simple model.
 
 # TODO(cec): Add tests on incrementally trained model predictions and losses.
@@ -237,6 +429,46 @@ def test_TensorFlowBackend_Sample_inexact_multiple_of_batch_size(
   assert len(saver.samples) == 6
 
 
+# _CopyState() tests.
+
+
+def test_CopyState_lstm_state():
+  """Test that the state of a multi-layer LSTM is copied."""
+  import tensorflow as tf
+  state = tuple(
+      tf.nn.rnn_cell.LSTMStateTuple(c=np.random.rand(2, 3),
+                                    h=np.random.rand(2, 3)) for _ in range(2))
+  state_copy = tensorflow_backend._CopyState(state)
+  assert type(state_copy) is tuple
+  assert len(state_copy) == 2
+  for layer, layer_copy in zip(state, state_copy):
+    assert type(layer_copy) is tf.nn.rnn_cell.LSTMStateTuple
+    np.testing.assert_array_equal(layer.c, layer_copy.c)
+    np.testing.assert_array_equal(layer.h, layer_copy.h)
+    assert layer.c is not layer_copy.c
+    assert layer.h is not layer_copy.h
+
+  # Modifying the copy does not modify the original.
+  state_copy[0].c[0, 0] = -1
+  assert state[0].c[0, 0] != -1
+
+
+def test_CopyState_gru_state():
+  """Test that the state of a multi-layer GRU is copied."""
+  state = tuple(np.random.rand(2, 3) for _ in range(2))
+  state_copy = tensorflow_backend._CopyState(state)
+  assert type(state_copy) is tuple
+  assert len(state_copy) == 2
+  for layer, layer_copy in zip(state, state_copy):
+    assert type(layer_copy) is np.ndarray
+    np.testing.assert_array_equal(layer, layer_copy)
+    assert layer is not layer_copy
+
+  # Modifying the copy does not modify the original.
+  state_copy[0][0, 0] = -1
+  assert state[0][0, 0] != -1
+
+
 # Benchmarks.
 
 
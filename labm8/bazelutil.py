@@ -5,6 +5,7 @@ contains utility code designed to help live with these quirks.
 """
 import os
 
+import functools
 import pathlib
 import re
 import subprocess
@@ -19,9 +20,13 @@ from labm8 import fs
 RUNFILES_PATTERN = re.compile(r'^(.*\.runfiles)/')
 
 
+@functools.lru_cache(maxsize=1)
 def FindRunfilesDirectory() -> typing.Optional[pathlib.Path]:
   """Find the '.runfiles' directory, if there is one.
 
+  The runfiles directory is determined by the location of this module, which
+  does not change during the lifetime of a process, so the result is cached.
+
   Returns:
     The absolute path of the runfiles directory, else None if not found.
   """
@@ -86,9 +91,7 @@ def DataString(path: typing.Union[str, pathlib.Path]) -> str:
   Raises:
     FileNotFoundError: If the requested path is not found.
   """
-  with open(DataPath(path)) as f:
-    contents = f.read()
-  return contents
+  return DataPath(path).read_bytes().decode('utf-8')
 
 
 class DataArchive(archive.Archive):
@@ -13,6 +13,7 @@
 # limitations under the License.
 """Transient and persistent caching mechanisms."""
 import atexit
+import functools
 import json
 import pathlib
 import re
@@ -188,43 +189,74 @@ class JsonCache(TransientCache):
     super(JsonCache, self).__init__()
     self.path = fs.abspath(path)
 
-    if fs.exists(self.path) and fs.Read(self.path):
+    contents = fs.Read(self.path) if fs.exists(self.path) else ''
+    if contents:
       io.debug(("Loading cache '{0}'".format(self.path)))
-      with open(self.path) as file:
-        self._data = json.load(file)
+      self._data = json.loads(contents)
+
+    # The serialized contents of the file on disk, or None if there is no
+    # file. Values may be mutated in place without going through
+    # __setitem__(), so changes are detected by comparing serialized contents
+    # rather than by tracking writes to the cache.
+    self._written_contents = contents or None
 
     if basecache is not None:
       for key, val in basecache.items():
         self._data[key] = val
 
     # Register exit handler
-    atexit.register(self.write)
+    atexit.register(self._write_if_changed)
+
+  def _serialize(self):
+    # The cache is machine-read, so it is serialized compactly.
+    return json.dumps(self._data, sort_keys=True, separators=(',', ':'))
+
+  def _write_if_changed(self):
+    """
+    Write contents of cache to disk, if they have changed.
+    """
+    contents = self._serialize()
+    if contents != self._written_contents:
+      self._write(contents)
 
   def write(self):
     """
     Write contents of cache to disk.
     """
+    self._write(self._serialize())
+
+  def _write(self, contents):
     io.debug("Storing cache '{0}'".format(self.path))
     with open(self.path, "w") as file:
-      json.dump(self._data,
-                file,
-                sort_keys=True,
-                indent=2,
-                separators=(',', ': '))
+      file.write(contents)
+    self._written_contents = contents
+
+
+# Characters which may not appear in a cache file name.
+_ESCAPE_PATH_RE = re.compile(r'[ \\/]+')
 
 
 def hash_key(key):
   """
   Convert a key to a filename by hashing its value.
   """
+  # String keys are hashable, so the result can be memoized.
+  if isinstance(key, str):
+    return _hash_str_key(key)
   return crypto.sha1_str(json.dumps(key, sort_keys=True))
 
 
+@functools.lru_cache(maxsize=4096)
+def _hash_str_key(key: str) -> str:
+  return crypto.sha1_str(json.dumps(key))
+
+
+@functools.lru_cache(maxsize=4096)
 def escape_path(key):
   """
   Convert a key to a filename by escaping invalid characters.
   """
-  return re.sub(r'[ \\/]+', '_', key)
+  return _ESCAPE_PATH_RE.sub('_', key)
 
 
 class FSCache(Cache):
@@ -336,7 +368,8 @@ class FSCache(Cache):
     """
     path = self.keypath(key)
     if fs.exists(path):
-      fs.rm(path)
+      # The path is a literal cache entry, so don't pattern-expand it.
+      fs.rm(path, glob=False)
     else:
       raise KeyError(key)
 
@@ -370,10 +403,8 @@ class FSCache(Cache):
     Returns:
         str: Path to cached file.
     """
-    if key in self:
-      return self[key]
-    else:
-      return default
+    path = self.keypath(key)
+    return path if fs.exists(path) else default
 
   def ls(self, **kwargs):
     """
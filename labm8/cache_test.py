@@ -0,0 +1,85 @@
+# Copyright 2014-2019 Chris Cummins <chrisc.101@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for //labm8:cache."""
+import pathlib
+
+from labm8 import app
+from labm8 import cache
+from labm8 import test
+
+FLAGS = app.FLAGS
+
+# JsonCache tests. The exit handler is invoked directly to simulate the
+# process exiting.
+
+
+def test_JsonCache_new_file_is_written_at_exit(tempdir: pathlib.Path):
+  """Test that a cache with no backing file creates one at exit."""
+  path = tempdir / 'cache.json'
+  c = cache.JsonCache(path)
+  c._write_if_changed()
+  assert path.read_text() == '{}'
+
+
+def test_JsonCache_setitem_is_written_at_exit(tempdir: pathlib.Path):
+  """Test that a new item is persisted."""
+  path = tempdir / 'cache.json'
+  c = cache.JsonCache(path)
+  c['a'] = 1
+  c._write_if_changed()
+  assert cache.JsonCache(path)['a'] == 1
+
+
+def test_JsonCache_in_place_mutation_is_written_at_exit(tempdir: pathlib.Path):
+  """Test that mutating a value in place is persisted."""
+  path = tempdir / 'cache.json'
+  c = cache.JsonCache(path)
+  c['a'] = [1]
+  c.write()
+
+  c = cache.JsonCache(path)
+  c['a'].append(2)
+  c._write_if_changed()
+  assert cache.JsonCache(path)['a'] == [1, 2]
+
+
+def test_JsonCache_unmodified_cache_is_not_written_at_exit(
+    tempdir: pathlib.Path):
+  """Test that an unmodified cache does not rewrite its file."""
+  path = tempdir / 'cache.json'
+  c = cache.JsonCache(path)
+  c['a'] = 1
+  c.write()
+
+  c = cache.JsonCache(path)
+  path.unlink()
+  c._write_if_changed()
+  assert not path.is_file()
+
+
+def test_JsonCache_clear_is_written_at_exit(tempdir: pathlib.Path):
+  """Test that clearing a cache is persisted."""
+  path = tempdir / 'cache.json'
+  c = cache.JsonCache(path)
+  c['a'] = 1
+  c.write()
+
+  c = cache.JsonCache(path)
+  c.clear()
+  c._write_if_changed()
+  assert 'a' not in cache.JsonCache(path)
+
+
+if __name__ == '__main__':
+  test.Main()
@@ -1,12 +1,13 @@
 """A module for launching docker images from within python applications."""
 import contextlib
+import itertools
+import json
 import pathlib
 import random
 import subprocess
 import typing
 
 from labm8 import app
-from labm8 import labtypes
 from labm8 import bazelutil
 
 
@@ -22,6 +23,19 @@ def _Docker(cmd: typing.List[str], timeout: int = 60):
   return cmd
 
 
+def _FlagsArgs(flags: typing.Dict[str, str]) -> typing.List[str]:
+  """Build the command line arguments for a dictionary of flags."""
+  return list(
+      itertools.chain.from_iterable(
+          (f'--{k}', str(v)) for k, v in (flags or {}).items()))
+
+
+def _VolumeArgs(volumes: typing.Dict[typing.Union[str, pathlib.Path], str]
+               ) -> typing.List[str]:
+  """Build the docker run arguments for a dictionary of volume mounts."""
+  return [f'-v{src}:{dst}' for src, dst in (volumes or {}).items()]
+
+
 class DockerImageRunContext(object):
   """A transient context for running docker images."""
 
@@ -33,11 +47,8 @@ class DockerImageRunContext(object):
       volumes: typing.Dict[typing.Union[str, pathlib.Path], str], timeout: int,
       entrypoint: str) -> typing.List[str]:
     entrypoint_args = ['--entrypoint', entrypoint] if entrypoint else []
-    volume_args = [f'-v{src}:{dst}' for src, dst in (volumes or {}).items()]
-    flags_args = labtypes.flatten(
-        [[f'--{k}', str(v)] for k, v in (flags or {}).items()])
-    return _Docker(['run'] + entrypoint_args + volume_args + [self.image_name] +
-                   args + flags_args, timeout)
+    return _Docker(['run'] + entrypoint_args + _VolumeArgs(volumes) +
+                   [self.image_name] + args + _FlagsArgs(flags), timeout)
 
   def CheckCall(
       self,
@@ -61,6 +72,33 @@ class DockerImageRunContext(object):
     return subprocess.check_output(cmd, universal_newlines=True)
 
 
+class DockerContainerExecContext(DockerImageRunContext):
+  """A transient context for running commands in a long-lived container.
+
+  Rather than starting a new container for every invocation, a single container
+  is started and each invocation is run in it using `docker exec`. This avoids
+  paying the container startup cost for every call. Since volumes cannot be
+  mounted in a running container, they must be declared when the context is
+  created.
+  """
+
+  def __init__(self, image_name: str, container_id: str,
+               entrypoint: typing.List[str]):
+    super(DockerContainerExecContext, self).__init__(image_name)
+    self.container_id = container_id
+    self.entrypoint = entrypoint
+
+  def _CommandLineInvocation(
+      self, args: typing.List[str], flags: typing.Dict[str, str],
+      volumes: typing.Dict[typing.Union[str, pathlib.Path], str], timeout: int,
+      entrypoint: str) -> typing.List[str]:
+    if volumes:
+      raise ValueError('Volumes must be declared when creating an exec context')
+    entrypoint_args = [entrypoint] if entrypoint else self.entrypoint
+    return _Docker(['exec', self.container_id] + entrypoint_args + args +
+                   _FlagsArgs(flags), timeout)
+
+
 class BazelPy3Image(object):
   """A docker image created using bazel's py3_image() rule.
 
@@ -117,11 +155,45 @@ class BazelPy3Image(object):
     subprocess.check_call(
         _Docker(['tag', self.image_name, tmp_name], timeout=60))
     subprocess.check_call(_Docker(['rmi', self.image_name], timeout=60))
-    yield DockerImageRunContext(tmp_name)
-    # FIXME(cec): Using the --force flag here is almost certainly the wrong
-    # thing, but I'm getting strange errors when trying to untag the image
-    # otherwise:
-    #   Error response from daemon: conflict: unable to remove repository
-    #   reference "phd_..." (must force) - container ... is using its
-    #   referenced image ...
-    subprocess.check_call(_Docker(['rmi', '--force', tmp_name], timeout=60))
+    try:
+      yield DockerImageRunContext(tmp_name)
+    finally:
+      # FIXME(cec): Using the --force flag here is almost certainly the wrong
+      # thing, but I'm getting strange errors when trying to untag the image
+      # otherwise:
+      #   Error response from daemon: conflict: unable to remove repository
+      #   reference "phd_..." (must force) - container ... is using its
+      #   referenced image ...
+      subprocess.check_call(_Docker(['rmi', '--force', tmp_name], timeout=60))
+
+  @contextlib.contextmanager
+  def ExecContext(
+      self,
+      volumes: typing.Dict[typing.Union[str, pathlib.Path], str] = None
+  ) -> DockerContainerExecContext:
+    """Run a long-lived container of the image.
+
+    Use this instead of RunContext() when making many invocations of the image,
+    to amortize the container startup cost.
+
+    Args:
+      volumes: The volumes to mount in the container.
+    """
+    with self.RunContext() as run_context:
+      image_name = run_context.image_name
+      inspect_cmd = _Docker(
+          ['inspect', '--format', '{{json .Config.Entrypoint}}', image_name],
+          timeout=60)
+      entrypoint = json.loads(
+          subprocess.check_output(inspect_cmd, universal_newlines=True))
+      run_cmd = _Docker(['run', '--detach', '--entrypoint', 'sleep'] +
+                        _VolumeArgs(volumes) + [image_name, 'infinity'],
+                        timeout=60)
+      container_id = subprocess.check_output(
+          run_cmd, universal_newlines=True).strip()
+      try:
+        yield DockerContainerExecContext(image_name, container_id,
+                                         entrypoint or [])
+      finally:
+        subprocess.check_call(
+            _Docker(['rm', '--force', container_id], timeout=60))
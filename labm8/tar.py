@@ -36,10 +36,7 @@ def unpack_archive(*components, **kwargs) -> str:
   compression = kwargs.get("compression", "bz2")
   dir = kwargs.get("dir", fs.dirname(path))
 
-  fs.cd(dir)
-  tar = tarfile.open(path, "r:" + compression)
-  tar.extractall()
-  tar.close()
-  fs.cdpop()
+  with tarfile.open(path, "r:" + compression) as tar:
+    tar.extractall(path=dir)
 
   return dir
@@ -17,13 +17,15 @@ This project uses pytest runner, with a handful of custom configuration options.
 Use the Main() function as the entry point to your test files to run pytest
 with the proper arguments.
 """
+import os
 import sys
 
+import ast
 import contextlib
 import inspect
 import pathlib
 import pytest
-import re
+import subprocess
 import tempfile
 import typing
 from importlib import util as importutil
@@ -52,15 +54,32 @@ app.DEFINE_integer(
 app.DEFINE_string(
     'test_coverage_data_dir', None,
     'Run tests with statement coverage and write coverage.py data files to '
-    'this directory. The directory is created. Existing files are untouched.')
+    'this directory. The directory is created. A coverage.py config file, '
+    'coveragerc, is written to the directory. Other existing files are '
+    'untouched.')
+app.DEFINE_string(
+    'test_coverage_backend',
+    'coverage',
+    'The tool used to record statement coverage of the module under test. One '
+    'of: "coverage", which uses coverage.py; "slipcover", which uses '
+    'SlipCover; or "none", which disables coverage. SlipCover has a much lower '
+    'overhead than coverage.py, but must be installed separately. It runs the '
+    'test file in a subprocess and, if --test_coverage_data_dir is set, writes '
+    'a JSON coverage file to that directory.',
+    validator=lambda v: v in {'coverage', 'slipcover', 'none'})
+app.DEFINE_integer(
+    'test_jobs',
+    0,
+    'The number of worker processes to run tests in, using pytest-xdist. If '
+    '--test_jobs=0, tests are run in this process.',
+    lower_bound=0)
 
 
 def AbsolutePathToModule(file_path: str) -> str:
   """Determine module name from an absolute path."""
-  match = re.match(r'.+\.runfiles/phd/(.+)', file_path)
-  if match:
-    # Strip everything up to the root of the project from the path.
-    module = match.group(1)
+  # Strip everything up to the root of the project from the path.
+  prefix, sep, module = file_path.rpartition('.runfiles/phd/')
+  if prefix and sep and module:
     # Strip the .py suffix.
     module = module[:-len('.py')]
     # Replace path sep with module sep.
@@ -70,29 +89,120 @@ def AbsolutePathToModule(file_path: str) -> str:
     raise OSError(f"Could not determine runfiles directory: {file_path}")
 
 
+def _ParseModuleUnderTest(file_path: str) -> typing.Tuple[bool, typing.Any]:
+  """Read the top-level MODULE_UNDER_TEST assignment of a file.
+
+  Args:
+    file_path: The path of the test file.
+
+  Returns:
+    A tuple of whether MODULE_UNDER_TEST is assigned, and the value it is
+    assigned.
+
+  Raises:
+    ValueError: If MODULE_UNDER_TEST is assigned a value which is not a
+      literal.
+  """
+  with open(file_path, 'rb') as f:
+    tree = ast.parse(f.read(), file_path)
+
+  found, value = False, None
+  for node in tree.body:
+    if isinstance(node, ast.Assign):
+      targets = node.targets
+    elif isinstance(node, ast.AnnAssign) and node.value:
+      targets = [node.target]
+    else:
+      continue
+    if any(
+        isinstance(t, ast.Name) and t.id == 'MODULE_UNDER_TEST'
+        for t in targets):
+      found, value = True, ast.literal_eval(node.value)
+  return found, value
+
+
 def GuessModuleUnderTest(file_path: str) -> typing.Optional[str]:
   """Determine the module under test. Returns None if no module under test."""
-  # Load the test module and check for a MODULE_UNDER_TEST attribute. If
-  # present, this is the name of the module under test. Valid values for
-  # MODULE_UNDER_TEST are a string, e.g. 'labm8.app', or None.
-  spec = importutil.spec_from_file_location('module', file_path)
-  test_module = importutil.module_from_spec(spec)
-  spec.loader.exec_module(test_module)
-  if hasattr(test_module, 'MODULE_UNDER_TEST'):
-    return test_module.MODULE_UNDER_TEST
+  # Check the test module for a MODULE_UNDER_TEST attribute. If present, this is
+  # the name of the module under test. Valid values for MODULE_UNDER_TEST are a
+  # string, e.g. 'labm8.app', or None. The assignment is read from the source
+  # of the test module, rather than executing the module, which would run its
+  # top-level code, and any side effects, a second time before pytest imports
+  # it. The module is only executed if the value is not a literal.
+  try:
+    found, module_under_test = _ParseModuleUnderTest(file_path)
+  except ValueError:
+    spec = importutil.spec_from_file_location('module', file_path)
+    test_module = importutil.module_from_spec(spec)
+    spec.loader.exec_module(test_module)
+    found = hasattr(test_module, 'MODULE_UNDER_TEST')
+    module_under_test = getattr(test_module, 'MODULE_UNDER_TEST', None)
+  if found:
+    return module_under_test
 
   # If the module under test was not specified, Guess the module name by
   # stripping the '_test' suffix from the name of the test module.
   return AbsolutePathToModule(file_path)[:-len('_test')]
 
 
+def RunFileWithSlipCover(file_path: str, module: str) -> int:
+  """Run a test file in a subprocess, recording coverage using SlipCover.
+
+  The test file is re-run as a script under SlipCover, with the same flags as
+  this process, so SlipCover instruments every module as it is first imported.
+
+  Args:
+    file_path: The path of the file to test.
+    module: The name of the module under test.
+
+  Returns:
+    The return code of the subprocess.
+  """
+  # SlipCover measures coverage of directories, so record the coverage of the
+  # package which contains the module under test. If the module cannot be
+  # found, fall back to the directory of the test file.
+  try:
+    spec = importutil.find_spec(module)
+  except ImportError:
+    spec = None
+  if spec and spec.submodule_search_locations:
+    source = pathlib.Path(list(spec.submodule_search_locations)[0])
+  elif spec and spec.origin:
+    source = pathlib.Path(spec.origin).parent
+  else:
+    source = pathlib.Path(file_path).parent
+
+  slipcover_args = ['--source', str(source)]
+  if FLAGS.test_coverage_data_dir:
+    datadir = pathlib.Path(FLAGS.test_coverage_data_dir)
+    datadir.mkdir(parents=True, exist_ok=True)
+    # Name the output file by PID, in the same manner as coverage.py's
+    # parallel data files.
+    slipcover_args += [
+        '--json', '--out',
+        str(datadir / f'slipcover.{os.getpid()}.json')
+    ]
+
+  # The flags of this process are forwarded to the subprocess. Coverage is
+  # disabled in the subprocess, since it is already running under SlipCover.
+  cmd = ([sys.executable, '-m', 'slipcover'] + slipcover_args + [file_path] +
+         sys.argv[1:] + ['--test_coverage_backend=none'])
+  app.Log(1, 'Running tests with SlipCover: %s', cmd)
+  return subprocess.call(cmd)
+
+
 @contextlib.contextmanager
-def CoverageContext(file_path: str,
+def CoverageContext(file_paths: typing.List[str],
                     pytest_args: typing.List[str]) -> typing.List[str]:
 
-  # Record coverage of module under test.
-  module = GuessModuleUnderTest(file_path)
-  if not module:
+  if FLAGS.test_coverage_backend == 'none':
+    yield pytest_args
+    return
+
+  # Record coverage of the modules under test.
+  modules = [GuessModuleUnderTest(file_path) for file_path in file_paths]
+  modules = [module for module in modules if module]
+  if not modules:
     app.Log(1, 'Coverage disabled - no module under test')
     yield pytest_args
     return
@@ -104,11 +214,14 @@ def CoverageContext(file_path: str,
       datadir.mkdir(parents=True, exist_ok=True)
     else:
       datadir = pathlib.Path(d)
-    # Create a coverage.py config file.
+    # Create a coverage.py config file. The config file is written alongside
+    # the data files. When --test_coverage_data_dir is set, an existing config
+    # file is only rewritten if its contents have changed. Concurrent test
+    # processes may share the directory, so the file is replaced atomically,
+    # and is never seen half-written.
     # See: https://coverage.readthedocs.io/en/coverage-4.3.4/config.html
-    config_path = f"{d}/converagerc"
-    with open(config_path, "w") as f:
-      f.write(f"""\
+    config_path = datadir / 'coveragerc'
+    config = f"""\
 [run]
 data_file = {datadir}/.coverage
 parallel = True
@@ -135,12 +248,17 @@ exclude_lines =
   # Don't complain if non-runnable code isn't run:
   if 0:
   if __name__ == .__main__.:
-""")
-
-    pytest_args += [
-        f'--cov={module}',
-        f'--cov-config={config_path}',
-    ]
+"""
+    if not config_path.is_file() or config_path.read_text() != config:
+      with tempfile.NamedTemporaryFile('w',
+                                       dir=datadir,
+                                       prefix='coveragerc.',
+                                       delete=False) as f:
+        f.write(config)
+      os.replace(f.name, config_path)
+
+    pytest_args += [f'--cov={module}' for module in modules]
+    pytest_args.append(f'--cov-config={config_path}')
     yield pytest_args
 
 
@@ -156,24 +274,65 @@ def RunPytestOnFileAndExit(file_path: str, argv: typing.List[str]):
     argv: Positional arguments not parsed by absl. No additional arguments are
       supported.
   """
+  RunPytestOnFilesAndExit([file_path], argv)
+
+
+def RunPytestOnFilesAndExit(file_paths: typing.List[str],
+                            argv: typing.List[str]):
+  """Run pytest on a list of files and exit.
+
+  The files are tested in a single pytest session, so the cost of starting
+  the session and of importing the modules shared by the files is only paid
+  once.
+
+  This is invoked by absl.app.RunWithArgs(), and has access to absl flags.
+
+  This function does not return.
+
+  Args:
+    file_paths: The paths of the files to test.
+    argv: Positional arguments not parsed by absl. No additional arguments are
+      supported.
+  """
   if len(argv) > 1:
     raise app.UsageError("Unknown arguments: '{}'.".format(' '.join(argv[1:])))
 
   # Test files must end with _test.py suffix. This is a code style choice, not
   # a hard requirement.
-  if not file_path.endswith('_test.py'):
-    app.Fatal("File `%s` does not end in suffix _test.py", file_path)
+  for file_path in file_paths:
+    if not file_path.endswith('_test.py'):
+      app.Fatal("File `%s` does not end in suffix _test.py", file_path)
+
+  # SlipCover runs the tests in a subprocess. If there is no module under test,
+  # the tests run in this process, and CoverageContext() disables coverage.
+  if FLAGS.test_coverage_backend == 'slipcover':
+    if len(file_paths) != 1:
+      raise app.UsageError(
+          '--test_coverage_backend=slipcover supports only a single test file')
+    # SlipCover records coverage of the process it runs the tests in, so tests
+    # run in pytest-xdist workers would not be covered.
+    if FLAGS.test_jobs:
+      raise app.UsageError(
+          '--test_coverage_backend=slipcover does not support --test_jobs')
+    module = GuessModuleUnderTest(file_paths[0])
+    if module:
+      sys.exit(RunFileWithSlipCover(file_paths[0], module))
 
   # Assemble the arguments to run pytest with. Note that the //:conftest file
   # performs some additional configuration not captured here.
-  pytest_args = [
-      file_path,
+  pytest_args = file_paths + [
       # Run pytest verbosely.
       '-vv',
-      '-p',
-      'no:cacheprovider',
   ]
 
+  # The pytest cache persists state between runs, such as the tests which last
+  # failed for --last-failed. Only keep it when tests are run directly. Disable
+  # it under `bazel test`, which sets TEST_TMPDIR, since the cache would be
+  # written into the runfiles tree and thrown away. Disable it on CI too, which
+  # sets CI.
+  if os.environ.get('TEST_TMPDIR') or os.environ.get('CI'):
+    pytest_args += ['-p', 'no:cacheprovider']
+
   if FLAGS.test_color:
     pytest_args.append('--color=yes')
 
@@ -188,7 +347,12 @@ def RunPytestOnFileAndExit(file_path: str, argv: typing.List[str]):
   if not FLAGS.test_capture_output:
     pytest_args.append('-s')
 
-  with CoverageContext(file_path, pytest_args) as pytest_args:
+  # Distribute the tests across worker processes. The //:conftest file passes
+  # the flags of this process on to the workers.
+  if FLAGS.test_jobs:
+    pytest_args += ['-n', str(FLAGS.test_jobs)]
+
+  with CoverageContext(file_paths, pytest_args) as pytest_args:
     app.Log(1, 'Running pytest with arguments: %s', pytest_args)
     ret = pytest.main(pytest_args)
   sys.exit(ret)
@@ -199,9 +363,9 @@ def Main():
   app.FLAGS(['argv[0]', '--vmodule=*=5'])
 
   # Get the file path of the calling function. This is used to identify the
-  # script to run the tests of.
-  frame = inspect.stack()[1]
-  module = inspect.getmodule(frame[0])
-  file_path = module.__file__
+  # script to run the tests of. The path is read from the frame, rather than
+  # from the module of the frame, since there is no module when the script is
+  # run by SlipCover, which executes the file's code directly.
+  file_path = inspect.stack()[1].filename
 
   app.RunWithArgs(lambda argv: RunPytestOnFileAndExit(file_path, argv))
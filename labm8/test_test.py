@@ -0,0 +1,178 @@
+# Copyright 2014-2019 Chris Cummins <chrisc.101@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for //labm8:test."""
+import os
+import subprocess
+import sys
+
+import pathlib
+
+import pytest
+
+from labm8 import test
+
+FLAGS = test.FLAGS
+
+
+@pytest.fixture(scope='function')
+def runfile(tempdir: pathlib.Path) -> pathlib.Path:
+  """A test fixture which returns the path of a test file in runfiles."""
+  path = tempdir / 'foo.runfiles' / 'phd' / 'pkg' / 'bar_test.py'
+  path.parent.mkdir(parents=True)
+  return path
+
+
+# _ParseModuleUnderTest() tests.
+
+
+def test_ParseModuleUnderTest_string(runfile: pathlib.Path):
+  """Test that a string literal is read."""
+  runfile.write_text("MODULE_UNDER_TEST = 'labm8.app'\n")
+  assert test._ParseModuleUnderTest(str(runfile)) == (True, 'labm8.app')
+
+
+def test_ParseModuleUnderTest_none(runfile: pathlib.Path):
+  """Test that a None literal is read."""
+  runfile.write_text("MODULE_UNDER_TEST = None\n")
+  assert test._ParseModuleUnderTest(str(runfile)) == (True, None)
+
+
+def test_ParseModuleUnderTest_annotated_assignment(runfile: pathlib.Path):
+  """Test that an annotated assignment is read."""
+  runfile.write_text("MODULE_UNDER_TEST: str = 'labm8.app'\n")
+  assert test._ParseModuleUnderTest(str(runfile)) == (True, 'labm8.app')
+
+
+def test_ParseModuleUnderTest_no_assignment(runfile: pathlib.Path):
+  """Test that a file without an assignment is reported as such."""
+  runfile.write_text("FOO = 'labm8.app'\n")
+  assert test._ParseModuleUnderTest(str(runfile)) == (False, None)
+
+
+def test_ParseModuleUnderTest_nested_assignment(runfile: pathlib.Path):
+  """Test that an assignment which is not at the top level is ignored."""
+  runfile.write_text("def Foo():\n  MODULE_UNDER_TEST = 'labm8.app'\n")
+  assert test._ParseModuleUnderTest(str(runfile)) == (False, None)
+
+
+def test_ParseModuleUnderTest_not_literal(runfile: pathlib.Path):
+  """Test that an error is raised if the value is not a literal."""
+  runfile.write_text("MODULE_UNDER_TEST = 'labm8.' + 'app'\n")
+  with pytest.raises(ValueError):
+    test._ParseModuleUnderTest(str(runfile))
+
+
+# GuessModuleUnderTest() tests.
+
+
+def test_GuessModuleUnderTest_string(runfile: pathlib.Path):
+  """Test that the module under test is read from a string literal."""
+  runfile.write_text("MODULE_UNDER_TEST = 'labm8.app'\n")
+  assert test.GuessModuleUnderTest(str(runfile)) == 'labm8.app'
+
+
+def test_GuessModuleUnderTest_none(runfile: pathlib.Path):
+  """Test that a test file can declare that there is no module under test."""
+  runfile.write_text("MODULE_UNDER_TEST = None\n")
+  assert test.GuessModuleUnderTest(str(runfile)) is None
+
+
+def test_GuessModuleUnderTest_no_assignment(runfile: pathlib.Path):
+  """Test that the module under test is guessed from the file path."""
+  runfile.write_text("FOO = 'labm8.app'\n")
+  assert test.GuessModuleUnderTest(str(runfile)) == 'pkg.bar'
+
+
+def test_GuessModuleUnderTest_literal_does_not_execute(runfile: pathlib.Path):
+  """Test that a file with a literal value is not executed."""
+  runfile.write_text("MODULE_UNDER_TEST = 'labm8.app'\n"
+                     "raise AssertionError('Test file was executed')\n")
+  assert test.GuessModuleUnderTest(str(runfile)) == 'labm8.app'
+
+
+def test_GuessModuleUnderTest_not_literal(runfile: pathlib.Path):
+  """Test that a file with a non-literal value is executed."""
+  runfile.write_text("MODULE_UNDER_TEST = 'labm8.' + 'app'\n")
+  assert test.GuessModuleUnderTest(str(runfile)) == 'labm8.app'
+
+
+# RunFileWithSlipCover() tests.
+
+
+def _RunTestFileWithSlipCover(path: pathlib.Path, import_root: pathlib.Path,
+                              datadir: pathlib.Path) -> int:
+  """Run a test file under SlipCover, and return its return code."""
+  # The test file imports the module under test from the import root, and
+  # labm8 from the tree which contains this file.
+  env = os.environ.copy()
+  env['PYTHONPATH'] = os.pathsep.join([
+      str(import_root),
+      str(pathlib.Path(test.__file__).parent.parent),
+      env.get('PYTHONPATH', '')
+  ])
+  return subprocess.call([
+      sys.executable,
+      str(path), '--test_coverage_backend=slipcover',
+      f'--test_coverage_data_dir={datadir}'
+  ],
+                         env=env,
+                         cwd=path.parent)
+
+
+def test_RunFileWithSlipCover_end_to_end(runfile: pathlib.Path,
+                                         tempdir: pathlib.Path):
+  """Test that a test file runs under SlipCover and writes coverage data."""
+  pytest.importorskip('slipcover')
+  (runfile.parent / 'bar.py').write_text("def Bar():\n  return 1\n")
+  runfile.write_text("""\
+from labm8 import test
+from pkg import bar
+
+def test_Bar():
+  assert bar.Bar() == 1
+
+if __name__ == '__main__':
+  test.Main()
+""")
+  datadir = tempdir / 'coverage'
+  assert _RunTestFileWithSlipCover(runfile, runfile.parent.parent,
+                                   datadir) == 0
+  assert len(list(datadir.glob('slipcover.*.json'))) == 1
+
+
+def test_RunFileWithSlipCover_outside_runfiles(tempdir: pathlib.Path):
+  """Test that a test file which is not in runfiles runs under SlipCover."""
+  pytest.importorskip('slipcover')
+  (tempdir / 'src').mkdir()
+  (tempdir / 'src' / 'bar.py').write_text("def Bar():\n  return 1\n")
+  path = tempdir / 'src' / 'foo_test.py'
+  path.write_text("""\
+from labm8 import test
+import bar
+
+MODULE_UNDER_TEST = 'bar'
+
+def test_Bar():
+  assert bar.Bar() == 1
+
+if __name__ == '__main__':
+  test.Main()
+""")
+  datadir = tempdir / 'coverage'
+  assert _RunTestFileWithSlipCover(path, path.parent, datadir) == 0
+  assert len(list(datadir.glob('slipcover.*.json'))) == 1
+
+
+if __name__ == '__main__':
+  test.Main()